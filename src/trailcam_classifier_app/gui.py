@@ -2,15 +2,20 @@ from __future__ import annotations
 
 # ruff: noqa: N802 Function name should be lowercase
 import asyncio
+import concurrent.futures
+import functools
+import json
 import os
+import struct
 import sys
 import threading
 import traceback
 import typing
+from collections import deque
 from pathlib import Path
 
 import qtinter
-from PySide6.QtCore import Q_ARG, QDataStream, QMetaObject, QSettings, Qt, Signal, Slot
+from PySide6.QtCore import QSettings, QSharedMemory, Qt, QTimer, Signal, Slot
 from PySide6.QtGui import QIntValidator
 from PySide6.QtNetwork import QLocalServer, QLocalSocket
 from PySide6.QtWidgets import (
@@ -21,10 +26,10 @@ from PySide6.QtWidgets import (
     QLabel,
     QLineEdit,
     QMainWindow,
+    QPlainTextEdit,
     QProgressBar,
     QPushButton,
     QSlider,
-    QTextEdit,
     QVBoxLayout,
     QWidget,
 )
@@ -32,53 +37,155 @@ from trailcam_classifier.main import ClassificationConfig, run_classification
 from trailcam_classifier.util import MODEL_SAVE_FILENAME
 
 _DEFAULT_OUTPUT_DIRECTORY = "images_with_objects_detected"
+_PENDING_UPDATE_INTERVAL_MS = 50
+_MAX_LOG_LINES = 5000
+_SINGLE_INSTANCE_KEY = "TrailcamClassifierApp"
+_HANDOFF_BUFFER_SIZE = 64 * 1024
+_HANDOFF_POLL_INTERVAL_MS = 100
+_OWNER_CONNECT_TIMEOUT_MS = 500
 
+_IS_BUNDLE = hasattr(sys, "_MEIPASS")
+# PyInstaller creates a temp folder and stores path in _MEIPASS
+_BASE_PATH = Path(getattr(sys, "_MEIPASS", None) or Path(".").absolute())
 
-def run_coroutine_in_thread(
-    window: MainWindow,
-    coroutine: typing.Coroutine,
-    *args,
-    **kwargs,
-) -> threading.Thread:
-    """Runs a coroutine in a new thread."""
 
-    def thread_target():
-        def thread_safe_logger(message: str):
-            QMetaObject.invokeMethod(window, "log", Qt.QueuedConnection, Q_ARG(str, message))
+def _run_event_loop(loop: asyncio.AbstractEventLoop):
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_forever()
+    finally:
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
 
-        def thread_safe_progress_update(item_name: str, total_count: int):
-            QMetaObject.invokeMethod(
-                window, "log_progress", Qt.QueuedConnection, Q_ARG(str, item_name), Q_ARG(int, total_count)
-            )
 
-        kwargs["logger"] = thread_safe_logger
-        kwargs["progress_update"] = thread_safe_progress_update
-        try:
-            asyncio.run(coroutine(*args, **kwargs))
-        except Exception:  # noqa: BLE001 Do not catch blind exception: `Exception`
-            tb = traceback.format_exc()
-            QMetaObject.invokeMethod(window, "log", Qt.QueuedConnection, Q_ARG(str, f"An error occurred:\n{tb}"))
-
-    thread = threading.Thread(target=thread_target)
-    thread.start()
-    return thread
+@functools.cache
+def _get_app_bundle_container_dir() -> Path:
+    """Returns the directory containing the .app bundle."""
+    # sys.executable is .../Blah.app/Contents/MacOS/Blah in a bundle
+    # .parents[3] is the directory containing the .app
+    return Path(sys.executable).parents[3]
 
 
 def get_resource_path(relative_path: str) -> Path:
     """Get the absolute path to a resource, works for dev and for PyInstaller"""
+    return _BASE_PATH / relative_path
 
-    try:
-        # PyInstaller creates a temp folder and stores path in _MEIPASS
-        base_path = Path(sys._MEIPASS)  # noqa: SLF001 Private member accessed: `_MEIPASS`
-    except AttributeError:
-        base_path = Path(".").absolute()
 
-    return base_path / relative_path
+_DEFAULT_MODEL_PATH = str(get_resource_path("model/trailcam_classifier_model.pt"))
 
 
 def is_bundle() -> bool:
     """Returns True if the application is running from a PyInstaller bundle."""
-    return hasattr(sys, "_MEIPASS")
+    return _IS_BUNDLE
+
+
+class SingleInstanceMailbox:
+    """Passes messages from secondary launches to the running instance through shared memory.
+
+    The segment starts with a header holding the number of payload bytes in use, followed by length-prefixed messages.
+    Each message is a JSON-encoded dict.
+
+    The owner also listens on a local server of the same name. It is only used to tell whether the owner is still
+    running, as the operating system accepts connections to it without any work by the owner.
+    """
+
+    _HEADER = struct.Struct("<I")
+    _LENGTH = struct.Struct("<I")
+
+    def __init__(self, key: str, size: int = _HANDOFF_BUFFER_SIZE):
+        self._key = key
+        self._shared_memory = QSharedMemory(key)
+        self._size = size
+        self._server: QLocalServer | None = None
+
+    def connect_to_owner(self) -> bool:
+        """Attaches to the mailbox of a running instance, returning False if there is none."""
+        socket = QLocalSocket()
+        socket.connectToServer(self._key)
+        owner_running = socket.waitForConnected(_OWNER_CONNECT_TIMEOUT_MS)
+        socket.abort()
+        if not owner_running:
+            return False
+        return self._shared_memory.attach()
+
+    def create(self) -> bool:
+        """Creates the mailbox for this instance to own."""
+        if not self._shared_memory.create(self._size):
+            # A previous owner exited without cleaning up. Attaching and detaching releases the segment if nobody else
+            # is attached, and a failed attach releases what remains of a segment that no longer exists.
+            if self._shared_memory.error() != QSharedMemory.AlreadyExists:
+                return False
+            if self._shared_memory.attach():
+                self._shared_memory.detach()
+            if not self._shared_memory.create(self._size):
+                return False
+
+        if not self._shared_memory.lock():
+            return False
+        self._HEADER.pack_into(memoryview(self._shared_memory.data()), 0, 0)
+        self._shared_memory.unlock()
+
+        # QLocalServer may not remove the socket file on unclean shutdowns.
+        QLocalServer.removeServer(self._key)
+        self._server = QLocalServer()
+        self._server.newConnection.connect(self._discard_connections)
+        return self._server.listen(self._key)
+
+    def _discard_connections(self):
+        while self._server.hasPendingConnections():
+            self._server.nextPendingConnection().abort()
+
+    def post(self, message: dict[str, typing.Any]) -> bool:
+        """Appends a message to the owner's mailbox, returning False if it could not be delivered."""
+        encoded = json.dumps(message).encode()
+        if not self._shared_memory.lock():
+            return False
+        try:
+            buffer = memoryview(self._shared_memory.data())
+            (used,) = self._HEADER.unpack_from(buffer)
+            start = self._HEADER.size + used
+            end = start + self._LENGTH.size + len(encoded)
+            if end > len(buffer):
+                return False
+
+            self._LENGTH.pack_into(buffer, start, len(encoded))
+            buffer[start + self._LENGTH.size : end] = encoded
+            self._HEADER.pack_into(buffer, 0, end - self._HEADER.size)
+            return True
+        finally:
+            self._shared_memory.unlock()
+
+    def take_messages(self) -> list[dict[str, typing.Any]]:
+        """Removes and returns all pending messages."""
+        if not self._shared_memory.isAttached() or not self._shared_memory.lock():
+            return []
+        try:
+            buffer = memoryview(self._shared_memory.data())
+            (used,) = self._HEADER.unpack_from(buffer)
+            self._HEADER.pack_into(buffer, 0, 0)
+
+            messages = []
+            offset = self._HEADER.size
+            end = offset + used
+            while offset < end:
+                (length,) = self._LENGTH.unpack_from(buffer, offset)
+                offset += self._LENGTH.size
+                messages.append(json.loads(bytes(buffer[offset : offset + length])))
+                offset += length
+            return messages
+        finally:
+            self._shared_memory.unlock()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        if self._shared_memory.isAttached():
+            self._shared_memory.detach()
 
 
 class Application(QApplication):
@@ -88,6 +195,8 @@ class Application(QApplication):
 
 
 class SettingsDialog(QDialog):
+    settings_changed = Signal()
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setWindowTitle("Settings")
@@ -164,6 +273,7 @@ class SettingsDialog(QDialog):
         self.settings.setValue("model_path", self.model_path_edit.text())
         self.settings.setValue("confidence_threshold", self.confidence_slider.value())
         super().accept()
+        self.settings_changed.emit()
 
 
 class DropLabel(QLabel):
@@ -216,25 +326,57 @@ class MainWindow(QMainWindow):
         self.setWindowTitle("Trailcam Classifier")
         self.setGeometry(100, 100, 600, 400)
         self.settings = QSettings()
-        self._classification_task = None
+        self._load_settings()
+        self._classification_task: asyncio.Future | None = None
+        # Completes once the classifier has actually stopped on the worker thread, which may be well after the
+        # classification task is cancelled as cancellation only takes effect at the classifier's next await.
+        self._classification_future: concurrent.futures.Future | None = None
+        # A single long-lived worker thread and event loop are reused for every classification run.
+        self._classification_loop = asyncio.new_event_loop()
+        self._classification_thread = threading.Thread(
+            target=_run_event_loop, args=(self._classification_loop,), name="classification", daemon=True
+        )
+        self._classification_thread.start()
+
+        # Log messages and progress updates may arrive from the classification thread at a very high rate, so they
+        # are accumulated here and drained onto the widgets periodically.
+        self._pending_lock = threading.Lock()
+        self._pending_messages: deque[str] = deque()
+        # Identifies the current classification run so that updates from a previous run can be discarded.
+        self._run_id = 0
         self._progress_counter = 0
+        self._progress_total = 0
+        self._progress_dirty = False
 
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
         layout = QVBoxLayout(central_widget)
         self.drop_label = DropLabel("Drop a folder here", self)
         layout.addWidget(self.drop_label)
-        self.log_widget = QTextEdit()
+        self.log_widget = QPlainTextEdit()
         self.log_widget.setReadOnly(True)
+        self.log_widget.setMaximumBlockCount(_MAX_LOG_LINES)
         layout.addWidget(self.log_widget)
 
+        progress_layout = QHBoxLayout()
         self.progress_bar = QProgressBar()
-        layout.addWidget(self.progress_bar)
+        progress_layout.addWidget(self.progress_bar)
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_classification)
+        progress_layout.addWidget(self.cancel_button)
+        layout.addLayout(progress_layout)
 
         self._create_menus()
         self.log_updated.connect(self.log)
         self.progress_updated.connect(self._on_progress_updated)
         QApplication.instance().new_file_open.connect(self.start_classification)
+        QApplication.instance().aboutToQuit.connect(self._stop_classification_loop)
+
+        self._pending_update_timer = QTimer(self)
+        self._pending_update_timer.setInterval(_PENDING_UPDATE_INTERVAL_MS)
+        self._pending_update_timer.timeout.connect(self._drain_pending_updates)
+        self._pending_update_timer.start()
 
     def _create_menus(self):
         menu_bar = self.menuBar()
@@ -246,22 +388,55 @@ class MainWindow(QMainWindow):
 
     def open_settings(self):
         dialog = SettingsDialog(self)
+        dialog.settings_changed.connect(self._load_settings)
         dialog.exec()
 
     @Slot(str)
-    def log(self, message: str):
-        self.log_widget.append(message)
+    def log(self, message: str, *, run_id: int | None = None):
+        """Queues a message for display. May be called from any thread.
+
+        Messages from a classification run other than the current one are discarded.
+        """
+        with self._pending_lock:
+            if run_id is None or run_id == self._run_id:
+                self._pending_messages.append(message)
+
+    def log_progress(self, _item_name: str, total_count: int, *, run_id: int | None = None):
+        """Records that one more item has been processed. May be called from any thread.
 
-    @Slot(str, int)
-    def log_progress(self, _item_name: str, total_count: int):
-        self._progress_counter += 1
-        self.progress_updated.emit(self._progress_counter, total_count)
+        Progress from a classification run other than the current one is discarded.
+        """
+        with self._pending_lock:
+            if run_id is not None and run_id != self._run_id:
+                return
+            self._progress_counter += 1
+            self._progress_total = total_count
+            self._progress_dirty = True
+
+    def _drain_pending_updates(self):
+        with self._pending_lock:
+            messages = list(self._pending_messages)
+            self._pending_messages.clear()
+            progress_dirty = self._progress_dirty
+            self._progress_dirty = False
+            progress_counter = self._progress_counter
+            progress_total = self._progress_total
+
+        if messages:
+            self.log_widget.appendPlainText("\n".join(messages))
+        if progress_dirty:
+            self.progress_updated.emit(progress_counter, progress_total)
 
     def _on_progress_updated(self, current_value: int, total_count: int):
         if self.progress_bar.maximum() != total_count:
             self.progress_bar.setMaximum(total_count)
         self.progress_bar.setValue(current_value)
 
+    def _load_settings(self):
+        self._output_directory = os.path.abspath(self.get_output_directory())
+        self._model_path = str(self.settings.value("model_path", _DEFAULT_MODEL_PATH))
+        self._confidence_threshold = self.settings.value("confidence_threshold", 65, type=int) / 100.0
+
     def get_output_directory(self) -> str:
         """Determines the output directory based on settings and execution context."""
         output_dir_setting = self.settings.value("output_directory")
@@ -271,10 +446,7 @@ class MainWindow(QMainWindow):
             if not output_path.is_absolute() and is_bundle():
                 # For relative paths when bundled, resolve them relative to the
                 # directory containing the .app bundle.
-                # sys.executable is .../Blah.app/Contents/MacOS/Blah in a bundle
-                # .parents[3] is the directory containing the .app
-                app_bundle_container_dir = Path(sys.executable).parents[3]
-                return str(app_bundle_container_dir / output_path)
+                return str(_get_app_bundle_container_dir() / output_path)
             return str(output_path)
 
         if is_bundle():
@@ -282,80 +454,108 @@ class MainWindow(QMainWindow):
         return _DEFAULT_OUTPUT_DIRECTORY
 
     def start_classification(self, folder_path: str):
-        if self._classification_task and self._classification_task.is_alive():
+        if (self._classification_task and not self._classification_task.done()) or (
+            self._classification_future and not self._classification_future.done()
+        ):
             self.log("A classification process is already running.")
             return
 
+        with self._pending_lock:
+            self._run_id += 1
+            run_id = self._run_id
+            self._pending_messages.clear()
+            self._progress_counter = 0
+            self._progress_dirty = False
         self.log_widget.clear()
         abs_folder_path = os.path.abspath(folder_path)
         self.log(f"Starting classification for folder: {abs_folder_path}")
         self.progress_bar.setValue(0)
-        self._progress_counter = 0
-
-        output_directory = os.path.abspath(self.get_output_directory())
-        default_model_path = str(get_resource_path("model/trailcam_classifier_model.pt"))
-        model_path: str = str(self.settings.value("model_path", default_model_path))
-        confidence_threshold_int = self.settings.value("confidence_threshold", 65, type=int)
-        confidence_threshold = confidence_threshold_int / 100.0
 
         config = ClassificationConfig(
             dirs=[abs_folder_path],
-            output=output_directory,
-            model=model_path,
-            confidence_threshold=confidence_threshold,
+            output=self._output_directory,
+            model=self._model_path,
+            confidence_threshold=self._confidence_threshold,
         )
 
-        self._classification_task = run_coroutine_in_thread(
-            self,
-            run_classification,
+        self._classification_task = asyncio.ensure_future(self._run_classification(config, run_id))
+        self._classification_task.add_done_callback(self._on_classification_done)
+        self.cancel_button.setEnabled(True)
+
+    def cancel_classification(self):
+        task = self._classification_task
+        if task and not task.done() and not task.cancelling():
+            task.cancel()
+            self.cancel_button.setEnabled(False)
+            self.log("Cancelling classification...")
+
+    async def _run_classification(self, config: ClassificationConfig, run_id: int):
+        # The classifier performs blocking model inference, so its coroutine is driven by the worker's event loop while
+        # this task lets the Qt-integrated loop observe its completion. Cancelling this task cancels the worker task.
+        classification = run_classification(
             config=config,
+            logger=functools.partial(self.log, run_id=run_id),
+            progress_update=functools.partial(self.log_progress, run_id=run_id),
         )
+        finished: concurrent.futures.Future[None] = concurrent.futures.Future()
+        self._classification_future = finished
+        try:
+            await asyncio.wrap_future(
+                asyncio.run_coroutine_threadsafe(self._classify(classification, finished), self._classification_loop)
+            )
+        except asyncio.CancelledError:
+            await asyncio.wrap_future(finished)
+            raise
+        except Exception:  # noqa: BLE001 Do not catch blind exception: `Exception`
+            tb = traceback.format_exc()
+            self.log(f"An error occurred:\n{tb}", run_id=run_id)
+
+    @staticmethod
+    async def _classify(classification: typing.Awaitable[None], finished: concurrent.futures.Future[None]):
+        """Runs the classifier on the worker thread, completing finished once it has stopped for any reason."""
+        try:
+            await classification
+        finally:
+            finished.set_result(None)
+
+    def _stop_classification_loop(self):
+        self.cancel_classification()
+        self._classification_loop.call_soon_threadsafe(self._classification_loop.stop)
+
+    def _on_classification_done(self, task: asyncio.Future):
+        self.cancel_button.setEnabled(False)
+        if task.cancelled():
+            self.log("Classification cancelled.")
 
 
 def run_gui():
     QApplication.setOrganizationName("BearBrains")
     QApplication.setApplicationName("Trailcam Classifier")
-    server_name = "TrailcamClassifierApp"
 
-    socket = QLocalSocket()
-    socket.connectToServer(server_name)
-
-    if socket.waitForConnected(500):
+    mailbox = SingleInstanceMailbox(_SINGLE_INSTANCE_KEY)
+    if mailbox.connect_to_owner():
         args = sys.argv[1:]
-        if args:
-            # We only process the first argument, which should be the folder path.
-            # The OS can sometimes pass the folder's contents as subsequent arguments.
-            out = QDataStream(socket)
-            out.writeQString(args[0])
-            socket.flush()
-            socket.waitForBytesWritten(1000)
-        socket.disconnectFromServer()
+        # We only process the first argument, which should be the folder path.
+        # The OS can sometimes pass the folder's contents as subsequent arguments.
+        if args and not mailbox.post({"path": args[0]}):
+            sys.stderr.write(f"Could not pass {args[0]} to the running instance.\n")
+        mailbox.close()
         return
 
-    server = QLocalServer()
-
-    def cleanup():
-        server.close()
-        # QLocalServer may not remove the socket file on all platforms
-        # especially on unclean shutdowns. We do it manually.
-        QLocalServer.removeServer(server_name)
-
     app = Application(sys.argv)
-    app.aboutToQuit.connect(cleanup)
-
-    server.listen(server_name)
-
-    def handle_new_connection():
-        socket = server.nextPendingConnection()
-        if socket:
-            socket.waitForReadyRead(1000)
-            stream = QDataStream(socket)
-            message = stream.readQString()
-            if message:
-                app.new_file_open.emit(message)
-            socket.disconnectFromServer()
-
-    server.newConnection.connect(handle_new_connection)
+    app.aboutToQuit.connect(mailbox.close)
+
+    def handle_mailbox_messages():
+        for message in mailbox.take_messages():
+            path = message.get("path")
+            if path:
+                app.new_file_open.emit(path)
+
+    mailbox_timer = QTimer()
+    mailbox_timer.setInterval(_HANDOFF_POLL_INTERVAL_MS)
+    mailbox_timer.timeout.connect(handle_mailbox_messages)
+    if mailbox.create():
+        mailbox_timer.start()
 
     with qtinter.using_asyncio_from_qt():
         window = MainWindow()
@@ -1,40 +1,170 @@
 from __future__ import annotations
 
-import itertools
+import bisect
 import os
+import queue
+import threading
+from array import array
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import TYPE_CHECKING, overload
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
 
 DEFAULT_IMAGE_EXTENSIONS = {"jpg", "jpeg"}
+_SCAN_WORKERS = 8
 
 
-def find_images(
-    input_dirs: list[str], ignore_dirs: list[str] | None = None, extensions: set[str] | None = None
-) -> set[Path]:
-    """Recursively finds all images in the given input_dirs."""
+def iter_images(
+    input_dirs: list[str],
+    ignore_dirs: list[str] | None = None,
+    extensions: set[str] | None = None,
+    max_workers: int = _SCAN_WORKERS,
+) -> Iterator[Path]:
+    """Recursively yields images in the given input_dirs as they are discovered.
+
+    Subdirectories are enumerated concurrently on a thread pool so that callers can begin processing results before
+    the traversal completes. Results are yielded in no particular order.
+    """
 
     if not extensions:
         extensions = DEFAULT_IMAGE_EXTENSIONS
 
-    input_dirs = [Path(os.path.expanduser(input_dir)) for input_dir in input_dirs]
-
-    combined_results = itertools.chain.from_iterable(base_path.rglob("*.*") for base_path in input_dirs)
-    all_files = set(combined_results)
+    input_paths = [Path(os.path.expanduser(input_dir)) for input_dir in input_dirs]
 
     if ignore_dirs is None:
         ignore_dirs = []
     ignored_paths = [Path(ignored) for ignored in ignore_dirs]
 
-    def keep_file(filename: Path) -> bool:
-        # Ignore dotfile metadata
-        if filename.name.startswith("."):
-            return False
+    def is_ignored(path: Path) -> bool:
+        return any(path.is_relative_to(ignored) for ignored in ignored_paths)
 
-        if any(filename.is_relative_to(ignored) for ignored in ignored_paths):
-            return False
+    found: queue.Queue[Path | None] = queue.Queue()
+    stop = threading.Event()
+    pending_lock = threading.Lock()
+    # Starts at 1 to account for the seeding of the root directories below.
+    pending = 1
+
+    def finish_directory():
+        nonlocal pending
+        with pending_lock:
+            pending -= 1
+            done = not pending
+        if done:
+            found.put(None)
+
+    def schedule_directory(directory: str):
+        nonlocal pending
+        with pending_lock:
+            pending += 1
+        try:
+            executor.submit(scan_directory, directory)
+        except RuntimeError:
+            # The executor has been shut down because the caller stopped iterating.
+            finish_directory()
+
+    def scan_directory(directory: str):
+        try:
+            if stop.is_set():
+                return
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not is_ignored(Path(entry.path)):
+                                schedule_directory(entry.path)
+                            continue
+
+                        # Ignore dotfile metadata
+                        if entry.name.startswith(".") or not entry.is_file():
+                            continue
+                    except OSError:
+                        continue
+
+                    path = Path(entry.path)
+                    if path.suffix[1:].lower() in extensions and not is_ignored(path):
+                        found.put(path)
+        except OSError:
+            pass
+        finally:
+            finish_directory()
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scan")
+    try:
+        for input_path in input_paths:
+            if not is_ignored(input_path):
+                schedule_directory(str(input_path))
+        finish_directory()
+
+        while (path := found.get()) is not None:
+            yield path
+    finally:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def find_images(
+    input_dirs: list[str], ignore_dirs: list[str] | None = None, extensions: set[str] | None = None
+) -> set[Path]:
+    """Recursively finds all images in the given input_dirs."""
+    return set(iter_images(input_dirs, ignore_dirs, extensions))
+
+
+class PackedPaths(Sequence[Path]):
+    """An immutable, sorted sequence of paths stored in a single contiguous buffer.
+
+    Keeping one Path object per entry is expensive for directories with tens of thousands of images, so entries are
+    stored as encoded bytes and only materialized as Path objects when accessed.
+    """
+
+    def __init__(self, paths: Iterable[Path]):
+        buffer = bytearray()
+        offsets = array("Q", [0])
+        for path in sorted(paths):
+            buffer += os.fsencode(path)
+            offsets.append(len(buffer))
+        self._buffer = bytes(buffer)
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    @overload
+    def __getitem__(self, index: int) -> Path: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[Path]: ...
+
+    def __getitem__(self, index: int | slice) -> Path | list[Path]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            msg = "PackedPaths index out of range"
+            raise IndexError(msg)
+        return Path(os.fsdecode(self._buffer[self._offsets[index] : self._offsets[index + 1]]))
 
-        if not filename.is_file():
+    def __contains__(self, value: object) -> bool:
+        try:
+            self.index(value)
+        except ValueError:
             return False
+        return True
 
-        return filename.suffix[1:].lower() in extensions
+    def index(self, value: object, start: int = 0, stop: int | None = None) -> int:
+        """Returns the index of the given path using a binary search."""
+        if not isinstance(value, Path):
+            msg = f"{value!r} is not in PackedPaths"
+            raise ValueError(msg)
 
-    return {filename for filename in all_files if keep_file(filename)}
+        if stop is None:
+            stop = len(self)
+        index = bisect.bisect_left(self, value, start, stop)
+        if index < stop and self[index] == value:
+            return index
+        msg = f"{value!r} is not in PackedPaths"
+        raise ValueError(msg)
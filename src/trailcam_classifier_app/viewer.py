@@ -2,11 +2,29 @@ from __future__ import annotations
 
 # ruff: noqa: N802 Function name should be lowercase
 import argparse
-import json
+import itertools
+import mmap
+import os
 import sys
-
-from PySide6.QtCore import QRect, QSize, Qt
-from PySide6.QtGui import QColor, QFont, QKeyEvent, QPainter, QPixmap
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from PySide6.QtCore import QObject, QRect, QRectF, QRunnable, QSize, Qt, QThreadPool, QTimer, Signal
+from PySide6.QtGui import (
+    QColor,
+    QFont,
+    QFontMetrics,
+    QImage,
+    QImageReader,
+    QKeyEvent,
+    QPainter,
+    QPainterPath,
+    QPen,
+    QPixmap,
+    QPixmapCache,
+)
 from PySide6.QtWidgets import (
     QApplication,
     QFileDialog,
@@ -16,7 +34,150 @@ from PySide6.QtWidgets import (
     QWidget,
 )
 
-from trailcam_classifier_app.util import find_images
+from trailcam_classifier_app.util import DEFAULT_IMAGE_EXTENSIONS, PackedPaths, iter_images
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    import json
+
+    def json_loads(data: bytes | memoryview):
+        return json.loads(bytes(data) if isinstance(data, memoryview) else data)
+
+
+_PIXMAP_CACHE_LIMIT_KB = 512 * 1024
+_METADATA_CACHE_SIZE = 1024
+# Number of images found before the full directory scan so that something can be displayed immediately.
+_INITIAL_SCAN_SIZE = 64
+# Boxes smaller than these dimensions, in source and display pixels respectively, are not drawn.
+_MIN_BBOX_SIZE = 2
+_MIN_SCALED_BBOX_SIZE = 1.5
+_LABEL_TEXT_CACHE_SIZE = 1024
+# Metadata files at least this large are memory mapped rather than read.
+_MMAP_THRESHOLD = 64 * 1024
+
+
+def _load_metadata_file(json_path: Path):
+    with open(json_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < _MMAP_THRESHOLD:
+            return json_loads(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+            return json_loads(view)
+
+
+def _decoded_size(source_size: QSize, max_size: QSize) -> QSize:
+    """Returns the size an image is decoded at so that it fits within max_size without being upscaled."""
+    if source_size.width() <= max_size.width() and source_size.height() <= max_size.height():
+        return QSize(source_size)
+    return source_size.scaled(max_size, Qt.KeepAspectRatio)
+
+
+class DirectoryScannerSignals(QObject):
+    # PackedPaths of all images, frozenset of metadata sidecar paths
+    scanned = Signal(object, object)
+    # Sorted labels found in metadata sidecars
+    labels_ready = Signal(list)
+
+
+class DirectoryScanner(QRunnable):
+    """Finds all images and their metadata sidecars in a directory off of the GUI thread.
+
+    The paths are reported as soon as the directory has been traversed, before the labels used in the sidecars are
+    gathered, as the latter requires reading every sidecar.
+    """
+
+    def __init__(self, directory: str, signals: DirectoryScannerSignals):
+        super().__init__()
+        self.directory = directory
+        self.signals = signals
+        self._stop = threading.Event()
+
+    def stop(self):
+        """Requests that the scan end early. May be called from any thread."""
+        self._stop.set()
+
+    def run(self):
+        images = []
+        sidecars = set()
+        for path in iter_images([self.directory], extensions=DEFAULT_IMAGE_EXTENSIONS | {"json"}):
+            # Sidecars are keyed by the path ImageLoader looks for, as the extension's case may differ.
+            if path.suffix.lower() == ".json":
+                sidecars.add(path.with_suffix(".json"))
+            else:
+                images.append(path)
+        image_paths = PackedPaths(images)
+        self.signals.scanned.emit(image_paths, frozenset(sidecars))
+
+        labels = set()
+        for image_path in image_paths:
+            if self._stop.is_set():
+                return
+            json_path = image_path.with_suffix(".json")
+            if json_path not in sidecars:
+                continue
+            try:
+                metadata = _load_metadata_file(json_path)
+            except (OSError, ValueError):
+                continue
+            if isinstance(metadata, dict):
+                labels.update(metadata)
+
+        self.signals.labels_ready.emit(sorted(labels))
+
+
+class ImageLoaderSignals(QObject):
+    # image_path, image, source image size, metadata
+    loaded = Signal(object, QImage, QSize, object)
+
+
+class ImageLoader(QRunnable):
+    """Decodes an image and its metadata sidecar off of the GUI thread.
+
+    Images are decoded at no more than max_size, allowing formats such as JPEG to skip most of the work of decoding at
+    full resolution. Once the directory scan has completed, its set of metadata sidecars is checked rather than the
+    filesystem.
+    """
+
+    def __init__(
+        self, image_path: Path, max_size: QSize, sidecars: frozenset[Path] | None, signals: ImageLoaderSignals
+    ):
+        super().__init__()
+        self.image_path = image_path
+        self.max_size = max_size
+        self.sidecars = sidecars
+        self.signals = signals
+
+    def run(self):
+        reader = QImageReader(str(self.image_path))
+        source_size = reader.size()
+        if source_size.isValid():
+            reader.setScaledSize(_decoded_size(source_size, self.max_size))
+        image = reader.read()
+        # A failed decode reports the null image's size so that it is not considered a reduced-size decode and retried.
+        if not source_size.isValid() or image.isNull():
+            source_size = image.size()
+
+        metadata = None
+        json_path = self.image_path.with_suffix(".json")
+        has_metadata = json_path in self.sidecars if self.sidecars is not None else json_path.exists()
+        if has_metadata:
+            # The image is still displayed if its metadata cannot be read or is malformed.
+            try:
+                metadata = {
+                    label: [
+                        bbox
+                        for bbox in bboxes
+                        if bbox["x2"] - bbox["x1"] >= _MIN_BBOX_SIZE and bbox["y2"] - bbox["y1"] >= _MIN_BBOX_SIZE
+                    ]
+                    for label, bboxes in _load_metadata_file(json_path).items()
+                }
+            except (OSError, ValueError, KeyError, TypeError, AttributeError):
+                metadata = None
+
+        self.signals.loaded.emit(self.image_path, image, source_size, metadata)
 
 
 class AnnotationLabel(QLabel):
@@ -24,52 +185,123 @@ class AnnotationLabel(QLabel):
         super().__init__(parent)
         self.metadata = None
         self.class_colors = {}
+        self._scaled_pixmap: QPixmap | None = None
+        self._overlay: QPixmap | None = None
+        self._target_rect = QRect()
+        self._scale = 0.0
+        self._source_size = QSize()
+
+        self._font = QFont("Helvetica")
+        self._font.setPointSize(16)
+        self._font_metrics = QFontMetrics(self._font)
+        self._outline_pen = QPen(QColor("black"), 4)
+        self._box_pen = QPen(QColor("black"), 2)
+        self._label_background = QColor("black")
+        self._default_color = QColor("yellow")
+        self._label_text_cache: OrderedDict[tuple[str, float], tuple[str, int]] = OrderedDict()
 
     def set_metadata(self, metadata, class_colors):
         self.metadata = metadata
         self.class_colors = class_colors
+        self._overlay = None
         self.update()
 
-    def sizeHint(self):
-        return QSize(100, 100)
+    def setPixmap(self, pixmap: QPixmap, source_size: QSize | None = None):
+        """Sets the displayed pixmap. source_size is the size of the original image the metadata refers to, if the
+        pixmap was decoded at a reduced size."""
+        super().setPixmap(pixmap)
+        self._source_size = source_size if source_size is not None else pixmap.size()
+        self._recompute_geometry()
 
-    def minimumSizeHint(self):
-        return QSize(10, 10)
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self._recompute_geometry()
 
-    def paintEvent(self, _event):
-        if not self.pixmap() or self.pixmap().isNull():
-            return
+    def _recompute_geometry(self):
+        """Computes where the pixmap is drawn within the widget and discards anything rendered for the old layout."""
+        self._scaled_pixmap = None
+        self._overlay = None
 
-        painter = QPainter(self)
-        cr = self.contentsRect()
         pm = self.pixmap()
+        if pm.isNull():
+            self._target_rect = QRect()
+            self._scale = 0.0
+            return
 
+        cr = self.contentsRect()
         pm_size = pm.size()
         pm_size.scale(cr.size(), Qt.KeepAspectRatio)
 
-        target_rect = QRect(0, 0, pm_size.width(), pm_size.height())
-        target_rect.moveCenter(cr.center())
+        self._target_rect = QRect(0, 0, pm_size.width(), pm_size.height())
+        self._target_rect.moveCenter(cr.center())
 
-        painter.drawPixmap(target_rect, pm)
+        # Metadata coordinates are relative to the original image rather than the potentially downscaled pixmap.
+        self._scale = min(
+            self._target_rect.width() / self._source_size.width(),
+            self._target_rect.height() / self._source_size.height(),
+        )
 
-        if not self.metadata:
+    def sizeHint(self):
+        return QSize(100, 100)
+
+    def minimumSizeHint(self):
+        return QSize(10, 10)
+
+    def paintEvent(self, _event):
+        if self._target_rect.isEmpty():
             return
 
-        font = QFont("Helvetica")
-        font.setPointSize(16)
-        painter.setFont(font)
+        device_pixel_ratio = self.devicePixelRatioF()
+        if self._scaled_pixmap is None or self._scaled_pixmap.devicePixelRatio() != device_pixel_ratio:
+            self._scaled_pixmap = self.pixmap().scaled(
+                self._target_rect.size() * device_pixel_ratio, Qt.KeepAspectRatio, Qt.SmoothTransformation
+            )
+            self._scaled_pixmap.setDevicePixelRatio(device_pixel_ratio)
 
-        original_pixmap_size = pm.size()
-        scale = min(
-            target_rect.width() / original_pixmap_size.width(),
-            target_rect.height() / original_pixmap_size.height(),
-        )
+        painter = QPainter(self)
+        painter.drawPixmap(self._target_rect.topLeft(), self._scaled_pixmap)
 
-        offset_x = target_rect.x()
-        offset_y = target_rect.y()
+        if not self.metadata:
+            return
 
+        if self._overlay is None or self._overlay.devicePixelRatio() != device_pixel_ratio:
+            self._overlay = self._render_overlay(device_pixel_ratio)
+        painter.drawPixmap(0, 0, self._overlay)
+
+    def _get_label_text(self, label: str, confidence: float) -> tuple[str, int]:
+        """Returns the text drawn for a box and its width, caching the result as text shaping is expensive."""
+        key = (label, round(confidence, 2))
+        entry = self._label_text_cache.get(key)
+        if entry:
+            self._label_text_cache.move_to_end(key)
+            return entry
+
+        label_text = f"{label}: {confidence:.2f}"
+        entry = (label_text, self._font_metrics.horizontalAdvance(label_text))
+        self._label_text_cache[key] = entry
+        if len(self._label_text_cache) > _LABEL_TEXT_CACHE_SIZE:
+            self._label_text_cache.popitem(last=False)
+        return entry
+
+    def _render_overlay(self, device_pixel_ratio: float) -> QPixmap:
+        """Draws the bounding boxes and labels into a transparent, widget-sized pixmap."""
+        overlay = QPixmap(self.size() * device_pixel_ratio)
+        overlay.setDevicePixelRatio(device_pixel_ratio)
+        overlay.fill(Qt.transparent)
+
+        painter = QPainter(overlay)
+        painter.setFont(self._font)
+        text_height = self._font_metrics.height()
+
+        scale = self._scale
+        offset_x = self._target_rect.x()
+        offset_y = self._target_rect.y()
+        widget_rect = QRectF(0, 0, self.width(), self.height())
+
+        # Boxes are stroked as one path per label so that pen changes happen per label rather than per box.
         for label, bboxes in self.metadata.items():
-            color = self.class_colors.get(label, QColor("yellow"))
+            boxes = QPainterPath()
+            labels = []
             for bbox in bboxes:
                 x1, y1, x2, y2 = bbox["x1"], bbox["y1"], bbox["x2"], bbox["y2"]
 
@@ -77,24 +309,18 @@ class AnnotationLabel(QLabel):
                 scaled_y1 = y1 * scale + offset_y
                 scaled_w = (x2 - x1) * scale
                 scaled_h = (y2 - y1) * scale
+                if (
+                    scaled_w < _MIN_SCALED_BBOX_SIZE
+                    or scaled_h < _MIN_SCALED_BBOX_SIZE
+                    or not widget_rect.intersects(QRectF(scaled_x1, scaled_y1, scaled_w, scaled_h))
+                ):
+                    continue
 
                 confidence = bbox.get("confidence", 0.0)
 
-                pen = painter.pen()
-                pen.setColor(QColor("black"))
-                pen.setWidth(4)
-                painter.setPen(pen)
-                painter.drawRect(int(scaled_x1), int(scaled_y1), int(scaled_w), int(scaled_h))
+                boxes.addRect(int(scaled_x1), int(scaled_y1), int(scaled_w), int(scaled_h))
 
-                pen.setColor(color)
-                pen.setWidth(2)
-                painter.setPen(pen)
-                painter.drawRect(int(scaled_x1), int(scaled_y1), int(scaled_w), int(scaled_h))
-
-                label_text = f"{label}: {confidence:.2f}"
-                metrics = painter.fontMetrics()
-                text_width = metrics.horizontalAdvance(label_text)
-                text_height = metrics.height()
+                label_text, text_width = self._get_label_text(label, confidence)
 
                 text_x = scaled_x1
                 if text_x + text_width > self.width():
@@ -106,17 +332,20 @@ class AnnotationLabel(QLabel):
                 if text_y - text_height < 0:
                     text_y = scaled_y1 + text_height
 
-                painter.fillRect(
-                    int(text_x),
-                    int(text_y - text_height),
-                    int(text_width),
-                    int(text_height),
-                    QColor("black"),
-                )
+                labels.append((int(text_x), int(text_y), text_width, label_text))
+
+            painter.setPen(self._outline_pen)
+            painter.drawPath(boxes)
+            self._box_pen.setColor(self.class_colors.get(label, self._default_color))
+            painter.setPen(self._box_pen)
+            painter.drawPath(boxes)
 
-                pen.setColor(color)
-                painter.setPen(pen)
-                painter.drawText(int(text_x), int(text_y), label_text)
+            for text_x, text_y, text_width, label_text in labels:
+                painter.fillRect(text_x, text_y - text_height, text_width, text_height, self._label_background)
+                painter.drawText(text_x, text_y, label_text)
+
+        painter.end()
+        return overlay
 
 
 class ViewerWindow(QMainWindow):
@@ -126,12 +355,22 @@ class ViewerWindow(QMainWindow):
         super().__init__()
         self.setWindowTitle("Trailcam Classifier Viewer")
         self.setGeometry(100, 100, 800, 600)
-        self.image_paths = sorted(find_images([directory]))
+        self.image_paths = self._find_initial_images(directory)
         self.current_image_index = 0
         self.image_label = AnnotationLabel()
         self.image_label.setAlignment(Qt.AlignCenter)
-        self.class_colors = {}
-        self.next_color_hue = 0.0
+        self.class_colors: dict[str, QColor] = {}
+        # Decoded pixmaps are held in the QPixmapCache, keyed by path. The original image size is kept alongside the
+        # metadata.
+        self._metadata_cache: OrderedDict[Path, tuple[QSize, dict | None]] = OrderedDict()
+        self._loading: set[Path] = set()
+        # Populated once the full directory scan completes.
+        self._sidecars: frozenset[Path] | None = None
+        # The signal holders are not parented to the window so that runnables still in flight when it is destroyed can
+        # emit safely. Each runnable keeps its holder alive.
+        self._loader_signals = ImageLoaderSignals()
+        self._loader_signals.loaded.connect(self._on_image_loaded)
+        self._resize_pending = False
         layout = QVBoxLayout()
         layout.addWidget(self.image_label)
         central_widget = QWidget()
@@ -139,6 +378,71 @@ class ViewerWindow(QMainWindow):
         self.setCentralWidget(central_widget)
         self.load_image()
 
+        self._scanner_signals = DirectoryScannerSignals()
+        self._scanner_signals.scanned.connect(self._on_paths_ready)
+        self._scanner_signals.labels_ready.connect(self._on_labels_ready)
+        # The scanner reads every metadata sidecar, so it is kept off of the global pool used to load images.
+        self._scanner_pool = QThreadPool(self)
+        self._scanner_pool.setMaxThreadCount(1)
+        self._scanner = DirectoryScanner(directory, self._scanner_signals)
+        self._scanner.setAutoDelete(False)
+        self._scanner_pool.start(self._scanner)
+
+    @staticmethod
+    def _find_initial_images(directory: str) -> list[Path]:
+        """Returns the first few images in directory so that something can be displayed immediately.
+
+        Directories are walked depth first in sorted order, so the result is the start of the sorted list of all images
+        that the full scan later produces.
+        """
+
+        def walk(path: str) -> Iterator[Path]:
+            try:
+                with os.scandir(path) as it:
+                    entries = sorted(it, key=lambda entry: os.path.normcase(entry.name))
+            except OSError:
+                return
+
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        yield from walk(entry.path)
+                        continue
+
+                    # Ignore dotfile metadata
+                    if entry.name.startswith(".") or not entry.is_file():
+                        continue
+                except OSError:
+                    continue
+
+                image_path = Path(entry.path)
+                if image_path.suffix[1:].lower() in DEFAULT_IMAGE_EXTENSIONS:
+                    yield image_path
+
+        return list(itertools.islice(walk(os.path.expanduser(directory)), _INITIAL_SCAN_SIZE))
+
+    def _on_paths_ready(self, image_paths: PackedPaths, sidecars: frozenset[Path]):
+        current_path = self.image_paths[self.current_image_index] if self.image_paths else None
+        self.image_paths = image_paths
+        self._sidecars = sidecars
+        self.current_image_index = 0
+        if current_path is not None and current_path in image_paths:
+            self.current_image_index = image_paths.index(current_path)
+        self.load_image()
+
+    def _on_labels_ready(self, labels: list[str]):
+        # Assigning colors in sorted label order keeps them stable regardless of the order images are viewed in.
+        self.class_colors = {}
+        for label in labels:
+            self._assign_class_color(label)
+
+        metadata = self.image_label.metadata
+        if metadata:
+            for label in metadata:
+                if label not in self.class_colors:
+                    self._assign_class_color(label)
+        self.image_label.set_metadata(metadata, self.class_colors)
+
     def load_image(self):
         if not self.image_paths:
             self.image_label.setPixmap(QPixmap())
@@ -147,26 +451,82 @@ class ViewerWindow(QMainWindow):
             return
 
         image_path = self.image_paths[self.current_image_index]
-        pixmap = QPixmap(str(image_path))
+        cached = self._get_cached_image(image_path)
+        if cached:
+            self._show_image(image_path, *cached)
+        else:
+            self._request_image(image_path)
+
+        num_images = len(self.image_paths)
+        for offset in (1, -1):
+            self._request_image(self.image_paths[(self.current_image_index + offset) % num_images])
+
+    def _decode_size(self) -> QSize:
+        """Returns the largest size that an image may need to be displayed at in the window, in device pixels."""
+        return self.size() * self.devicePixelRatioF()
+
+    def _is_decoded_size_sufficient(self, pixmap: QPixmap, source_size: QSize) -> bool:
+        """Returns True if the pixmap was decoded at a large enough size to be displayed without upscaling."""
+        if pixmap.size() == source_size:
+            return True
+        required = _decoded_size(source_size, self._decode_size())
+        # Allows for rounding differences between the requested and decoded dimensions.
+        return pixmap.width() >= required.width() - 1 and pixmap.height() >= required.height() - 1
+
+    def _get_cached_image(self, image_path: Path) -> tuple[QPixmap, QSize, dict | None] | None:
+        if image_path not in self._metadata_cache:
+            return None
+        pixmap = QPixmapCache.find(str(image_path))
+        if pixmap is None:
+            return None
+        source_size, metadata = self._metadata_cache[image_path]
+        if not self._is_decoded_size_sufficient(pixmap, source_size):
+            return None
+        self._metadata_cache.move_to_end(image_path)
+        return pixmap, source_size, metadata
+
+    def _request_image(self, image_path: Path):
+        if image_path in self._loading or self._get_cached_image(image_path):
+            return
+        self._loading.add(image_path)
+        QThreadPool.globalInstance().start(
+            ImageLoader(image_path, self._decode_size(), self._sidecars, self._loader_signals)
+        )
 
-        filename = image_path.name
-        self.setWindowTitle(f"Trailcam Classifier Viewer - {filename} ({pixmap.width()}x{pixmap.height()})")
+    def _on_image_loaded(self, image_path: Path, image: QImage, source_size: QSize, metadata: dict | None):
+        self._loading.discard(image_path)
+        pixmap = QPixmap.fromImage(image)
+        QPixmapCache.insert(str(image_path), pixmap)
+        self._metadata_cache[image_path] = (source_size, metadata)
+        while len(self._metadata_cache) > _METADATA_CACHE_SIZE:
+            self._metadata_cache.popitem(last=False)
+
+        if self.image_paths and image_path == self.image_paths[self.current_image_index]:
+            self._show_image(image_path, pixmap, source_size, metadata)
+            # The window may have grown while the image was being decoded.
+            if not pixmap.isNull() and not self._is_decoded_size_sufficient(pixmap, source_size):
+                self._request_image(image_path)
+
+    def _show_image(self, image_path: Path, pixmap: QPixmap, source_size: QSize, metadata: dict | None):
+        self.setWindowTitle(
+            f"Trailcam Classifier Viewer - {image_path.name} ({source_size.width()}x{source_size.height()})"
+        )
 
-        metadata = None
-        json_path = image_path.with_suffix(".json")
-        if json_path.exists():
-            with open(json_path) as f:
-                metadata = json.load(f)
+        if metadata:
             for label in metadata:
                 if label not in self.class_colors:
-                    self.next_color_hue += self.GOLDEN_RATIO_CONJUGATE
-                    self.next_color_hue %= 1
-                    self.class_colors[label] = QColor.fromHsvF(self.next_color_hue, 0.7, 0.95)
+                    self._assign_class_color(label)
 
-        self.image_label.setPixmap(pixmap)
+        self.image_label.setPixmap(pixmap, source_size)
         self.image_label.set_metadata(metadata, self.class_colors)
 
+    def _assign_class_color(self, label: str):
+        hue = ((len(self.class_colors) + 1) * self.GOLDEN_RATIO_CONJUGATE) % 1
+        self.class_colors[label] = QColor.fromHsvF(hue, 0.7, 0.95)
+
     def keyPressEvent(self, event: QKeyEvent):
+        if not self.image_paths:
+            return
         if event.key() == Qt.Key_Right:
             self.current_image_index = (self.current_image_index + 1) % len(self.image_paths)
             self.load_image()
@@ -174,9 +534,24 @@ class ViewerWindow(QMainWindow):
             self.current_image_index = (self.current_image_index - 1 + len(self.image_paths)) % len(self.image_paths)
             self.load_image()
 
+    def closeEvent(self, event):
+        # Destroying the scanner pool waits for the scanner, so it is not left to finish reading every sidecar.
+        self._scanner.stop()
+        QThreadPool.globalInstance().clear()
+        super().closeEvent(event)
+
     def resizeEvent(self, event):
-        del event
-        self.load_image()
+        super().resizeEvent(event)
+        if not self._resize_pending:
+            self._resize_pending = True
+            QTimer.singleShot(16, self._do_resize)
+
+    def _do_resize(self):
+        self._resize_pending = False
+        self.image_label.update()
+        # Images decoded for a smaller window are decoded again from disk at the new size.
+        if self.image_paths:
+            self._request_image(self.image_paths[self.current_image_index])
 
 
 def main():
@@ -184,6 +559,7 @@ def main():
     parser.add_argument("directory", nargs="?", default=None, help="Directory containing images and metadata.")
     args = parser.parse_args()
     app = QApplication(sys.argv)
+    QPixmapCache.setCacheLimit(_PIXMAP_CACHE_LIMIT_KB)
     if args.directory:
         directory = args.directory
     else:
@@ -0,0 +1,3 @@
+# SPDX-FileCopyrightText: 2025-present Erik Abair <erik.abair@gmail.com>
+#
+# SPDX-License-Identifier: MIT
@@ -0,0 +1,204 @@
+from __future__ import annotations
+
+import itertools
+import os
+import threading
+from pathlib import Path
+
+import pytest
+
+from trailcam_classifier_app.util import DEFAULT_IMAGE_EXTENSIONS, PackedPaths, find_images, iter_images
+
+
+def _find_images_with_rglob(
+    input_dirs: list[str], ignore_dirs: list[str] | None = None, extensions: set[str] | None = None
+) -> set[Path]:
+    """The original rglob-based implementation of find_images."""
+    if not extensions:
+        extensions = DEFAULT_IMAGE_EXTENSIONS
+
+    input_paths = [Path(os.path.expanduser(input_dir)) for input_dir in input_dirs]
+    all_files = set(itertools.chain.from_iterable(base_path.rglob("*.*") for base_path in input_paths))
+
+    if ignore_dirs is None:
+        ignore_dirs = []
+    ignored_paths = [Path(ignored) for ignored in ignore_dirs]
+
+    def keep_file(filename: Path) -> bool:
+        if filename.name.startswith("."):
+            return False
+        if any(filename.is_relative_to(ignored) for ignored in ignored_paths):
+            return False
+        if not filename.is_file():
+            return False
+        return filename.suffix[1:].lower() in extensions
+
+    return {filename for filename in all_files if keep_file(filename)}
+
+
+@pytest.fixture
+def image_tree(tmp_path: Path) -> Path:
+    files = [
+        "a.jpg",
+        "b.JPG",
+        "c.jpeg",
+        "d.png",
+        "e.json",
+        "noextension",
+        ".hidden.jpg",
+        "sub/f.jpg",
+        "sub/g.Jpeg",
+        "sub/deeper/h.jpg",
+        "sub/deeper/.i.jpg",
+        "ignored/j.jpg",
+        "ignored/nested/k.jpg",
+        ".dotdir/l.jpg",
+        "other/m.jpg",
+    ]
+    for name in files:
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"")
+
+    (tmp_path / "dir.jpg").mkdir()
+    os.symlink(tmp_path / "a.jpg", tmp_path / "sub" / "link.jpg")
+    os.symlink(tmp_path / "missing.jpg", tmp_path / "sub" / "broken.jpg")
+    os.symlink(tmp_path / "other", tmp_path / "sub" / "linked_dir")
+    return tmp_path
+
+
+def test_find_images_matches_rglob(image_tree: Path):
+    assert find_images([str(image_tree)]) == _find_images_with_rglob([str(image_tree)])
+
+
+def test_find_images_matches_rglob_with_ignored_dirs(image_tree: Path):
+    ignored = [str(image_tree / "ignored"), str(image_tree / "sub" / "deeper")]
+
+    result = find_images([str(image_tree)], ignored)
+
+    assert result == _find_images_with_rglob([str(image_tree)], ignored)
+    assert not any(path.is_relative_to(image_tree / "ignored") for path in result)
+
+
+def test_find_images_matches_rglob_with_extensions(image_tree: Path):
+    extensions = {"png", "json"}
+    assert find_images([str(image_tree)], extensions=extensions) == _find_images_with_rglob(
+        [str(image_tree)], extensions=extensions
+    )
+
+
+def test_find_images_matches_rglob_for_multiple_dirs(image_tree: Path):
+    dirs = [str(image_tree / "sub"), str(image_tree / "other")]
+    assert find_images(dirs) == _find_images_with_rglob(dirs)
+
+
+def test_find_images_handles_missing_dir(tmp_path: Path):
+    assert find_images([str(tmp_path / "missing")]) == set()
+
+
+def test_find_images_filters_as_expected(image_tree: Path):
+    assert {path.relative_to(image_tree).as_posix() for path in find_images([str(image_tree)])} == {
+        "a.jpg",
+        "b.JPG",
+        "c.jpeg",
+        "sub/f.jpg",
+        "sub/g.Jpeg",
+        "sub/deeper/h.jpg",
+        "sub/link.jpg",
+        "ignored/j.jpg",
+        "ignored/nested/k.jpg",
+        ".dotdir/l.jpg",
+        "other/m.jpg",
+    }
+
+
+def test_iter_images_yields_each_image_once(image_tree: Path):
+    results = list(iter_images([str(image_tree)]))
+    assert len(results) == len(set(results))
+
+
+def test_iter_images_early_close_does_not_hang(tmp_path: Path):
+    for i in range(50):
+        directory = tmp_path / f"dir{i}"
+        directory.mkdir()
+        for j in range(20):
+            (directory / f"{j}.jpg").write_bytes(b"")
+
+    def consume_first():
+        images = iter_images([str(tmp_path)], max_workers=2)
+        first = next(images)
+        images.close()
+        assert first.suffix == ".jpg"
+
+    thread = threading.Thread(target=consume_first, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+
+
+def test_iter_images_can_be_restarted_after_early_close(image_tree: Path):
+    images = iter_images([str(image_tree)])
+    next(images)
+    images.close()
+
+    assert set(iter_images([str(image_tree)])) == find_images([str(image_tree)])
+
+
+_PATHS = [
+    Path("/images/b.jpg"),
+    Path("/images/a/z.jpg"),
+    Path("/images/a.jpg"),
+    Path("/images/\u00e9t\u00e9.jpg"),
+    Path("/images/c/d/e.jpeg"),
+]
+
+
+def test_packed_paths_is_sorted():
+    packed = PackedPaths(_PATHS)
+
+    assert len(packed) == len(_PATHS)
+    assert list(packed) == sorted(_PATHS)
+
+
+def test_packed_paths_indexing():
+    packed = PackedPaths(_PATHS)
+    expected = sorted(_PATHS)
+
+    for i, path in enumerate(expected):
+        assert packed[i] == path
+        assert packed[i - len(expected)] == path
+
+    with pytest.raises(IndexError):
+        packed[len(expected)]
+    with pytest.raises(IndexError):
+        packed[-len(expected) - 1]
+
+
+@pytest.mark.parametrize("index", [slice(None), slice(1, 3), slice(None, None, -1), slice(-2, None), slice(4, 1, -2)])
+def test_packed_paths_slicing(index: slice):
+    assert PackedPaths(_PATHS)[index] == sorted(_PATHS)[index]
+
+
+def test_packed_paths_index_and_contains():
+    packed = PackedPaths(_PATHS)
+    expected = sorted(_PATHS)
+
+    for i, path in enumerate(expected):
+        assert packed.index(path) == i
+        assert path in packed
+
+    assert Path("/images/missing.jpg") not in packed
+    assert "/images/a.jpg" not in packed
+    with pytest.raises(ValueError, match="is not in PackedPaths"):
+        packed.index(Path("/images/missing.jpg"))
+    with pytest.raises(ValueError, match="is not in PackedPaths"):
+        packed.index(expected[0], 1)
+
+
+def test_packed_paths_empty():
+    packed = PackedPaths([])
+
+    assert len(packed) == 0
+    assert list(packed) == []
+    assert packed[:] == []
+    assert Path("/images/a.jpg") not in packed